@@ -1,3 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numba import njit
+from ._welford import welford_step
+
+@njit(cache=True, nogil=True)
+def _cusum_core(data, k, h, burnin, n, M2, mu, sigma, S, T):
+    # Compiled CUSUM loop, writes mean, standard deviation, S and T by index into 
+    # preallocated arrays whose first entry holds the current state
+    changepoints = np.empty(len(data), dtype=np.int64)
+    c = 0
+    mu_i = mu[0]
+    for i in range(1, len(data)):
+        x = data[i]
+        mu_i, M2 = welford_step(mu_i, M2, x, n)
+        sigma_i = (M2 / n) ** 0.5
+        mu[i] = mu_i
+        sigma[i] = sigma_i
+        S[i] = max(0., S[i-1] + (x - mu_i) / sigma_i - k)
+        T[i] = max(0., T[i-1] - (x - mu_i) / sigma_i - k)
+        if (i >= burnin) and ((S[i] > h) or (T[i] > h)):
+            changepoints[c] = i
+            c += 1
+            M2 /= n
+            S[i] = 0.
+            T[i] = 0.
+            n = 2
+        else:
+            n += 1
+    return changepoints[:c], n, M2
+
 class CUSUM():
     """Cumulative Sum algorithm.
     
@@ -61,43 +92,82 @@ class CUSUM():
         self.mu = mu
         self.sigma = sigma
 
-        self._mu = [mu]
-        self._sigma = [sigma]
-        self.S = [0.]
-        self.T = [0.]
+        # Recorded statistics are rows of a single buffer
+        self._buffer = np.array([[mu], [sigma], [0.], [0.]], dtype=np.float64)
+        self._mu, self._sigma, self.S, self.T = self._buffer
         self.changepoints = []
         self.n = 2
+        self._M2 = sigma ** 2
+    
+    def allocate(self, 
+                 n_samples: int):
+        """Preallocate the recorded statistics for a stream of given length.
+
+        Parameters
+        ----------
+        
+        n_samples : int
+            Length of the data stream. Its first observation is aligned with the last 
+            recorded entry, which holds the current state of the algorithm, the following
+            ones are written by index after the existing records by the update methods.
+        """
+        self._grow(len(self._mu) + n_samples - 2)
+    
+    def _grow(self, 
+              i: int):
+        # Extend the recorded statistics up to time index i when they were not
+        # preallocated, doubling the buffer capacity so that streaming stays linear
+        length = len(self._mu)
+        if i < length:
+            return
+        if i >= self._buffer.shape[1]:
+            buffer = np.empty((4, max(i + 1, 2 * self._buffer.shape[1])), dtype=np.float64)
+            buffer[:, :length] = self._buffer[:, :length]
+            self._buffer = buffer
+        self._mu, self._sigma, self.S, self.T = self._buffer[:, :i+1]
     
     def update_mean_variance(self, 
+                             i: int, 
                              data_new: float):
         """Update efficiently mean and variance.
 
         Parameters
         ----------
         
+        i : int
+            Time index. Recorded statistics are extended if they were not preallocated.
+        
         data_new : float
             New observation in the data stream. The mean and variance are updated
-            efficiently and online without storing every observed values. 
+            efficiently and online without storing every observed values. The sum of
+            squared deviations is carried, the standard deviation is only computed when
+            the statistics are updated.
         """
-        mu_new = self.mu + (data_new - self.mu) / self.n
-        self.sigma = (self.sigma ** 2 + ((data_new - self.mu) * (data_new - mu_new) - self.sigma ** 2) / self.n) ** 0.5
-        self.mu = mu_new
-        self._mu.append(mu_new)
-        self._sigma.append(self.sigma)
+        self._grow(i)
+        # Plain Python version of the compiled step, avoiding the dispatch overhead
+        self.mu, self._M2 = welford_step.py_func(self.mu, self._M2, data_new, self.n)
+        self._mu[i] = self.mu
         
     def update_statistics(self, 
+                          i: int, 
                           data_new: float):
         """Update the algorithm statistics S and T.
 
         Parameters
         ----------
         
+        i : int
+            Time index.
+        
         data_new : float
             New observation in the data stream. S and T are updated according to
             CUSUM algorithm formulas.
         """
-        self.S.append(max(0, self.S[-1] + (data_new - self.mu) / self.sigma - self.k))
-        self.T.append(max(0, self.T[-1] - (data_new - self.mu) / self.sigma - self.k))
+        self._grow(i)
+        self.sigma = (self._M2 / self.n) ** 0.5
+        self._sigma[i] = self.sigma
+        self.S[i] = max(0, self.S[i-1] + (data_new - self.mu) / self.sigma - self.k)
+        self.T[i] = max(0, self.T[i-1] - (data_new - self.mu) / self.sigma - self.k)
     
     def decision_rule(self, 
                       i: int):
@@ -109,10 +179,15 @@ class CUSUM():
         i : int
             Time index. The decision rule S > h or T > h is implemented in this method.
         """
-        if (i >= self.burnin) and ((self.S[-1] > self.h) or (self.T[-1] > self.h)):
+        if i < self.burnin:
+            self.n += 1
+            return
+        h = self.h
+        if self.S[i] > h or self.T[i] > h:
             self.changepoints.append(i)
-            self.S[-1] = 0
-            self.T[-1] = 0
+            self.S[i] = 0
+            self.T[i] = 0
+            self._M2 /= self.n
             self.n = 2
         else:
             self.n += 1
@@ -127,9 +202,54 @@ class CUSUM():
         data : list
             Univariate data stream to be processed. The method sequentially first updates mean 
             and variance, then updates the S and T statistics and finally applies the simple
-            decision rule to assert if a change has occurred.
+            decision rule to assert if a change has occurred. The loop is compiled with Numba.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        # Recorded statistics are appended to, from the entry holding the current state
+        offset = len(self._mu) - 1
+        self.allocate(len(data))
+        changepoints, self.n, self._M2 = _cusum_core(data, self.k, self.h, self.burnin, self.n, self._M2, 
+                                                  self._mu[offset:], self._sigma[offset:], 
+                                                  self.S[offset:], self.T[offset:])
+        self.changepoints.extend(changepoints.tolist())
+        self.mu = self._mu[-1]
+        self.sigma = self._sigma[-1]
+    
+    def process_multi(self, 
+                      data: np.ndarray, 
+                      n_jobs: int = None):
+        """Run CUSUM algorithm independently on each stream of a multivariate data stream.
+
+        Parameters
+        ----------
+            
+        data : ndarray of shape (n_samples, n_series)
+            Independent univariate data streams to be processed, one per column. Every stream
+            starts from the current state of the algorithm, which is left unchanged. The 
+            compiled loop releases the GIL, so the streams are processed in parallel threads.
+        
+        n_jobs : int, default=None
+            Maximum number of threads, defaults to the ThreadPoolExecutor default.
+        
+        Returns
+        -------
+        
+        changepoints : list
+            List of detected changepoints for each stream. Recorded statistics and 
+            attributes of the algorithm are not modified.
         """
-        for i in range(1, len(data)):
-            self.update_mean_variance(data[i])
-            self.update_statistics(data[i])
-            self.decision_rule(i)
\ No newline at end of file
+        data = np.asfortranarray(data, dtype=np.float64)
+        if data.ndim != 2:
+            raise ValueError("data must be of shape (n_samples, n_series), got %d dimension(s)." % data.ndim)
+        S0, T0 = self.S[-1], self.T[-1]
+        
+        def process_series(j):
+            # Each stream writes its statistics into its own arrays
+            mu, sigma, S, T = np.empty((4, len(data)), dtype=np.float64)
+            mu[0], sigma[0], S[0], T[0] = self.mu, self.sigma, S0, T0
+            changepoints, _, _ = _cusum_core(data[:, j], self.k, self.h, self.burnin, self.n, self._M2, 
+                                            mu, sigma, S, T)
+            return changepoints.tolist()
+        
+        with ThreadPoolExecutor(n_jobs) as executor:
+            return list(executor.map(process_series, range(data.shape[1])))
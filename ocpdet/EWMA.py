@@ -1,3 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from numba import njit
+from ._welford import welford_step, sigma_Z_cutoff
+
+@njit(cache=True, nogil=True)
+def _ewma_core(data, r, L, burnin, n, M2, mu, sigma, Z, sigma_Z):
+    # Compiled EWMA loop, writes mean, standard deviation, Z and sigma_Z by index into 
+    # preallocated arrays whose first entry holds the current state
+    changepoints = np.empty(len(data), dtype=np.int64)
+    c = 0
+    mu_i = mu[0]
+    i_cutoff = sigma_Z_cutoff(r)
+    c_Z = (r / (2 - r)) ** 0.5
+    for i in range(1, len(data)):
+        x = data[i]
+        mu_i, M2 = welford_step(mu_i, M2, x, n)
+        sigma_i = (M2 / n) ** 0.5
+        mu[i] = mu_i
+        sigma[i] = sigma_i
+        Z[i] = (1 - r) * Z[i-1] + r * x
+        if i >= i_cutoff:
+            sigma_Z[i] = sigma_i * c_Z
+        else:
+            sigma_Z[i] = sigma_i * ((r / (2 - r)) * (1 - (1 - r) ** (2 * i))) ** 0.5
+        if (i >= burnin) and (abs((Z[i] - mu_i) / L) > sigma_Z[i]):
+            changepoints[c] = i
+            c += 1
+            M2 /= n
+            n = 2
+        else:
+            n += 1
+    return changepoints[:c], n, M2
+
 class EWMA():
     """Exponentially Weighted Moving Average algorithm.
         
@@ -60,29 +94,63 @@ class EWMA():
         self.mu = mu
         self.sigma = sigma
 
-        self._mu = [mu]
-        self._sigma = [sigma]
-        self.Z = [mu]
-        self.sigma_Z = [0.]
+        # Recorded statistics are rows of a single buffer
+        self._buffer = np.array([[mu], [sigma], [mu], [0.]], dtype=np.float64)
+        self._mu, self._sigma, self.Z, self.sigma_Z = self._buffer
         self.changepoints = []
         self.n = 2
+        self._M2 = sigma ** 2
+        self._i_cutoff = sigma_Z_cutoff(r)
+        self._c_Z = (r / (2 - r)) ** 0.5
+    
+    def allocate(self, 
+                 n_samples: int):
+        """Preallocate the recorded statistics for a stream of given length.
+
+        Parameters
+        ----------
         
+        n_samples : int
+            Length of the data stream. Its first observation is aligned with the last 
+            recorded entry, which holds the current state of the algorithm, the following
+            ones are written by index after the existing records by the update methods.
+        """
+        self._grow(len(self._mu) + n_samples - 2)
+    
+    def _grow(self, 
+              i: int):
+        # Extend the recorded statistics up to time index i when they were not
+        # preallocated, doubling the buffer capacity so that streaming stays linear
+        length = len(self._mu)
+        if i < length:
+            return
+        if i >= self._buffer.shape[1]:
+            buffer = np.empty((4, max(i + 1, 2 * self._buffer.shape[1])), dtype=np.float64)
+            buffer[:, :length] = self._buffer[:, :length]
+            self._buffer = buffer
+        self._mu, self._sigma, self.Z, self.sigma_Z = self._buffer[:, :i+1]
+    
     def update_mean_variance(self, 
+                             i: int, 
                              data_new: float):
         """Update efficiently mean and variance.
 
         Parameters
         ----------
         
+        i : int
+            Time index. Recorded statistics are extended if they were not preallocated.
+        
         data_new : float
             New observation in the data stream. The mean and variance are updated
-            efficiently and online without storing every observed values. 
+            efficiently and online without storing every observed values. The sum of
+            squared deviations is carried, the standard deviation is only computed when
+            the statistics are updated.
         """
-        mu_new = self.mu + (data_new - self.mu) / self.n
-        self.sigma = (self.sigma ** 2 + ((data_new - self.mu) * (data_new - mu_new) - self.sigma ** 2) / self.n) ** 0.5
-        self.mu = mu_new
-        self._mu.append(mu_new)
-        self._sigma.append(self.sigma)
+        self._grow(i)
+        # Plain Python version of the compiled step, avoiding the dispatch overhead
+        self.mu, self._M2 = welford_step.py_func(self.mu, self._M2, data_new, self.n)
+        self._mu[i] = self.mu
     
     def update_statistics(self, 
                           i: int, 
@@ -99,8 +167,14 @@ class EWMA():
             New observation in the data stream. Z and sigma_Z are updated according to
             EWMA algorithm formulas.
         """
-        self.Z.append((1 - self.r) * self.Z[-1] + self.r * data_new)
-        self.sigma_Z.append(self.sigma * ((self.r / (2 - self.r)) * (1 - (1 - self.r) ** (2 * i))) ** 0.5)
+        self._grow(i)
+        self.sigma = (self._M2 / self.n) ** 0.5
+        self._sigma[i] = self.sigma
+        self.Z[i] = (1 - self.r) * self.Z[i-1] + self.r * data_new
+        if i >= self._i_cutoff:
+            self.sigma_Z[i] = self.sigma * self._c_Z
+        else:
+            self.sigma_Z[i] = self.sigma * ((self.r / (2 - self.r)) * (1 - (1 - self.r) ** (2 * i))) ** 0.5
     
     def decision_rule(self, 
                       i: int):
@@ -112,8 +186,9 @@ class EWMA():
         i : int
             Time index. The decision rule |Z - mu| / sigma_Z > L is implemented in this method.
         """
-        if (i >= self.burnin) and (abs((self.Z[-1] - self.mu) / self.L) > self.sigma_Z[-1]):
+        if (i >= self.burnin) and (abs((self.Z[i] - self.mu) / self.L) > self.sigma_Z[i]):
             self.changepoints.append(i)
+            self._M2 /= self.n
             self.n = 2
         else:
             self.n += 1
@@ -128,9 +203,54 @@ class EWMA():
         data : list
             Univariate data stream to be processed. The method sequentially first updates mean 
             and variance, then updates the Z and sigma_Z statistics and finally applies the simple
-            decision rule to assert if a change has occurred.
+            decision rule to assert if a change has occurred. The loop is compiled with Numba.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        # Recorded statistics are appended to, from the entry holding the current state
+        offset = len(self._mu) - 1
+        self.allocate(len(data))
+        changepoints, self.n, self._M2 = _ewma_core(data, self.r, self.L, self.burnin, self.n, self._M2, 
+                                                  self._mu[offset:], self._sigma[offset:], 
+                                                  self.Z[offset:], self.sigma_Z[offset:])
+        self.changepoints.extend(changepoints.tolist())
+        self.mu = self._mu[-1]
+        self.sigma = self._sigma[-1]
+    
+    def process_multi(self, 
+                      data: np.ndarray, 
+                      n_jobs: int = None):
+        """Run EWMA algorithm independently on each stream of a multivariate data stream.
+
+        Parameters
+        ----------
+            
+        data : ndarray of shape (n_samples, n_series)
+            Independent univariate data streams to be processed, one per column. Every stream
+            starts from the current state of the algorithm, which is left unchanged. The 
+            compiled loop releases the GIL, so the streams are processed in parallel threads.
+        
+        n_jobs : int, default=None
+            Maximum number of threads, defaults to the ThreadPoolExecutor default.
+        
+        Returns
+        -------
+        
+        changepoints : list
+            List of detected changepoints for each stream. Recorded statistics and 
+            attributes of the algorithm are not modified.
         """
-        for i in range(1, len(data)):
-            self.update_mean_variance(data[i])
-            self.update_statistics(i, data[i])
-            self.decision_rule(i)
\ No newline at end of file
+        data = np.asfortranarray(data, dtype=np.float64)
+        if data.ndim != 2:
+            raise ValueError("data must be of shape (n_samples, n_series), got %d dimension(s)." % data.ndim)
+        Z0, sigma_Z0 = self.Z[-1], self.sigma_Z[-1]
+        
+        def process_series(j):
+            # Each stream writes its statistics into its own arrays
+            mu, sigma, Z, sigma_Z = np.empty((4, len(data)), dtype=np.float64)
+            mu[0], sigma[0], Z[0], sigma_Z[0] = self.mu, self.sigma, Z0, sigma_Z0
+            changepoints, _, _ = _ewma_core(data[:, j], self.r, self.L, self.burnin, self.n, self._M2, 
+                                            mu, sigma, Z, sigma_Z)
+            return changepoints.tolist()
+        
+        with ThreadPoolExecutor(n_jobs) as executor:
+            return list(executor.map(process_series, range(data.shape[1])))
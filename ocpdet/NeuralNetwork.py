@@ -5,6 +5,72 @@ from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.layers import Dense, Conv1D, BatchNormalization, Flatten
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.initializers import GlorotNormal
+from numba import njit
+from ._welford import sigma_Z_cutoff
+
+@njit(cache=True, nogil=True)
+def _detect_core(dissimilarity, r, L, burnin, timeout, bump):
+    # Compiled modified EWMA on the dissimilarity sequence, detecting bumps if bump is 
+    # True and increases otherwise. Works with variances, the decision rules 
+    # Z > mu + L sigma_Z and Z < mu - L sigma_Z are compared in squares given the sign 
+    # of Z - mu
+    N = len(dissimilarity)
+    Z = np.zeros(N)
+    var_Z = np.zeros(N)
+    mu = np.zeros(N)
+    changepoints = np.empty(N, dtype=np.int64)
+    c = 0
+    n = 2
+    mu_hat = 0.
+    sigma_hat = 1.
+    last_cp = 0
+    # Bump state, last_det < 0 when no increase is pending
+    increased = False
+    last_det = -1
+    # Running power (1 - r) ** (2 * j), until it vanishes against 1
+    pow2j = 1.
+    j_cutoff = sigma_Z_cutoff(r)
+    c_Z = r / (2 - r)
+    L2 = L * L
+    # The original running estimator, which mixes sigma_hat and its square, is kept on 
+    # purpose so that detections match the previous release
+    for j in range(1, N):
+        x = dissimilarity[j]
+        Z[j] = (1 - r) * Z[j-1] + r * x
+        mu_hat_new = 1 / n * ((n - 1) * mu_hat + x)
+        var_hat = 1 / (n - 1) * ((x - mu_hat_new) * (x - mu_hat) + (n - 2) * sigma_hat)
+        sigma_hat = np.sqrt(var_hat)
+        mu_hat = mu_hat_new
+        n += 1
+        if j >= j_cutoff:
+            var_Z[j] = var_hat * c_Z
+        else:
+            pow2j *= (1 - r) ** 2
+            var_Z[j] = var_hat * c_Z * (1 - pow2j)
+        mu[j] = mu_hat
+        if j < burnin:
+            continue
+        diff = Z[j] - mu_hat
+        above = diff > 0 and diff * diff > var_Z[j] * L2
+        below = diff < 0 and diff * diff > var_Z[j] * L2
+        if bump:
+            if above and last_det < 0:
+                increased = True
+                last_det = j
+                n = 2
+            if below and increased:
+                increased = False
+                n = 2
+                changepoints[c] = last_det
+                c += 1
+                last_det = -1
+        elif above:
+            if j - last_cp > timeout:
+                changepoints[c] = j
+                c += 1
+                last_cp = j
+            n = 2
+    return Z, var_Z, mu, changepoints[:c]
 
 class NeuralNetwork():
     """Online changepoint detection using neural networks.
@@ -50,6 +116,24 @@ class NeuralNetwork():
         Timeout period to be used if method='increase'. When a changepoint is detected, no change
         can be detected in the following timeout data observations.
     
+    batch_size : int, default=1
+        Number of consecutive time steps whose mini-batches are passed through the neural 
+        network at once, followed by a single gradient step on the averaged loss. Use 1 for 
+        fully sequential learning, larger values trade it for throughput.
+    
+    verbose : bool, default=True
+        Whether to display a progress bar while computing the dissimilarity sequence.
+    
+    jit_compile : bool, default=True
+        Whether to compile the forward and backward passes of each training step with XLA.
+        Disable it if the neural network f contains operations not supported by XLA.
+    
+    dtype_policy : str, default='float32'
+        Keras dtype policy of the default neural network architecture, either 'float32' or 
+        'mixed_bfloat16'. Use 'mixed_bfloat16' to run the convolutions in half precision on 
+        hardware supporting it, the output layer always computes in float32. 'mixed_float16' 
+        is not supported as the training loop does not scale the loss. Ignored when f is given.
+    
     Attributes
     ----------
     
@@ -82,19 +166,26 @@ class NeuralNetwork():
                  L: float = 3., 
                  burnin: int = 100, 
                  method: str = "bump", 
-                 timeout: int = 100):
+                 timeout: int = 100, 
+                 batch_size: int = 1, 
+                 verbose: bool = True, 
+                 jit_compile: bool = True, 
+                 dtype_policy: str = "float32"):
         self.k = k
         self.n = n
         self.l = lag
+        if dtype_policy != "float32" and dtype_policy != "mixed_bfloat16":
+            print("Dtype policy can either be 'float32' or 'mixed_bfloat16'.")
+            dtype_policy = "float32"
         if f is None:
             # Neural network architecture by default
             self.f = Sequential([
-                Conv1D(16, 2, activation="elu", input_shape=(self.n, self.k), kernel_initializer=GlorotNormal()),
-                BatchNormalization(),
-                Conv1D(8, 2, activation="elu", kernel_initializer=GlorotNormal()),
-                BatchNormalization(),
-                Flatten(),
-                Dense(1, activation="sigmoid", kernel_initializer=GlorotNormal())
+                Conv1D(16, 2, activation="elu", input_shape=(self.n, self.k), kernel_initializer=GlorotNormal(), dtype=dtype_policy),
+                BatchNormalization(dtype=dtype_policy),
+                Conv1D(8, 2, activation="elu", kernel_initializer=GlorotNormal(), dtype=dtype_policy),
+                BatchNormalization(dtype=dtype_policy),
+                Flatten(dtype=dtype_policy),
+                Dense(1, activation="sigmoid", kernel_initializer=GlorotNormal(), dtype="float32")
             ])
         else:
             self.f = f
@@ -103,6 +194,8 @@ class NeuralNetwork():
         self.mu = [0.]
         self.burnin = burnin
         self.timeout = timeout
+        self.batch_size = batch_size
+        self.verbose = verbose
         if method == "bump" or method == "increase":
             self.method = method
         else:
@@ -112,6 +205,7 @@ class NeuralNetwork():
         self.divergence = []
         self.dissimilarity = []
         self.optimiser = Adam()
+        self.step = tf.function(self.dissimilarity_step, jit_compile=jit_compile)
         self.Z = [0.]
         self.sigma_Z = [0.]
         self.changepoints = []
@@ -125,103 +219,81 @@ class NeuralNetwork():
         
         data : list
             d-dimensional data stream to be processed to create the mini-batches of data.
+            Autoregressive forms and mini-batches are read-only views on the stream, no 
+            data is copied.
         """
-        T = len(data)
-        self.X = []
-        for i in range(T - self.k + 1):
-            self.X.append(data[i:self.k+i])
-        self.X = np.asarray(self.X)
-        self.Xi = []
-        for i in range(T - self.k - self.n + 2):
-            self.Xi.append(self.X[i:self.n+i])
-        self.Xi = np.asarray(self.Xi)
+        # Strided views over the stream, the window axis is moved next to the time axis
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        self.X = np.moveaxis(np.lib.stride_tricks.sliding_window_view(data, self.k, axis=0), -1, 1)
+        self.Xi = np.moveaxis(np.lib.stride_tricks.sliding_window_view(self.X, self.n, axis=0), -1, 1)
+
+    def dissimilarity_step(self, 
+                           X_lagged: np.ndarray, 
+                           X_recent: np.ndarray):
+        """Compare lagged and recent mini-batches with the neural network.
+
+        Parameters
+        ----------
+        
+        X_lagged : ndarray
+            Lagged mini-batches, labelled 0 by the neural network classifier.
+        
+        X_recent : ndarray
+            Recent mini-batches, labelled 1 by the neural network classifier.
+
+        Returns
+        -------
+        
+        d : tf.Tensor
+            Kullback-Leibler divergence estimated for each pair of mini-batches.
+        
+        grads : list
+            Gradients of the classification loss with respect to the trainable weights.
+        """
+        with tf.GradientTape() as tape:
+            p_lagged = self.f(X_lagged)
+            p_recent = self.f(X_recent)
+            loss_value = - tf.reduce_mean(tf.math.log(1 - p_lagged) + tf.math.log(p_recent))
+        grads = tape.gradient(loss_value, self.f.trainable_weights)
+        d = tf.math.log((1 - p_lagged) / p_lagged) + tf.math.log(p_recent / (1 - p_recent))
+        return d, grads
 
     def compute_dissimilarity(self):
         """Compute the dissimilarity sequence.
         """
-        for i in tqdm(range(len(self.Xi) - self.l - 1)):
-            X_lagged = self.Xi[i][tf.newaxis, ...]
-            X_recent = self.Xi[i+self.l][tf.newaxis, ...]
-            d = tf.math.log((1 - self.f(X_lagged)) / self.f(X_lagged)) + tf.math.log(self.f(X_recent) / (1 - self.f(X_recent)))
-            if i <= self.l + 1:
-                self.dissimilarity.append(0.)
-            else:
-                d_bar = self.dissimilarity[-1] + (d - self.divergence[i-1-self.l]) / self.l
-                self.dissimilarity.append(d_bar.numpy()[0][0])
-            self.divergence.append(d.numpy()[0][0])
-            with tf.GradientTape() as tape:
-                loss_value = - tf.math.log(1 - self.f(X_lagged)) - tf.math.log(self.f(X_recent))
-            grads = tape.gradient(loss_value, self.f.trainable_weights)
+        T = max(len(self.Xi) - self.l - 1, 0)
+        self.divergence = np.empty(T, dtype=np.float32)
+        starts = range(0, T, self.batch_size)
+        for start in tqdm(starts, mininterval=1., miniters=max(1, len(starts) // 200), disable=not self.verbose):
+            stop = min(start + self.batch_size, T)
+            X_lagged = self.Xi[start:stop]
+            X_recent = self.Xi[start+self.l:stop+self.l]
+            d, grads = self.step(X_lagged, X_recent)
+            self.divergence[start:stop] = d.numpy()[:, 0]
             self.optimiser.apply_gradients(zip(grads, self.f.trainable_weights))
-        self.divergence = np.asarray(self.divergence)
-        self.dissimilarity = np.asarray(self.dissimilarity)
+        # Rolling update d_bar[i] = d_bar[i-1] + (d[i] - d[i-1-l]) / l started at i = l + 2, 
+        # written in closed form with cumulative sums
+        c = np.cumsum(self.divergence, dtype=np.float64)
+        self.dissimilarity = np.zeros(T, dtype=np.float32)
+        if T > self.l + 2:
+            i = np.arange(self.l + 2, T)
+            self.dissimilarity[i] = (c[i] - c[self.l+1] - c[i-1-self.l] + c[0]) / self.l
         
     def detect_increase(self):
         """Detect increases in the dissimilarity.
         """
-        n = 2
-        mu_hat = 0.
-        sigma_hat = 1.
-        last_cp = 0
-        for j in range(1, self.burnin):
-            self.Z.append((1 - self.r) * self.Z[j-1] + self.r * self.dissimilarity[j])
-            mu_hat_new = 1/n * ((n-1) * mu_hat + self.dissimilarity[j])
-            sigma_hat = np.sqrt(1 / (n - 1) * ((self.dissimilarity[j] - mu_hat_new) * 
-                                             (self.dissimilarity[j] - mu_hat) + (n - 2) * sigma_hat))
-            mu_hat = mu_hat_new
-            n += 1
-            self.sigma_Z.append(sigma_hat * np.sqrt((self.r / (2 - self.r)) * (1 - (1 - self.r) ** (2 * j))))
-            self.mu.append(mu_hat)
-        for j in range(self.burnin, len(self.dissimilarity)):
-            self.Z.append((1 - self.r) * self.Z[j-1] + self.r * self.dissimilarity[j])
-            mu_hat_new = 1/n * ((n-1) * mu_hat + self.dissimilarity[j])
-            sigma_hat = np.sqrt(1 / (n - 1) * ((self.dissimilarity[j] - mu_hat_new) * 
-                                             (self.dissimilarity[j] - mu_hat) + (n - 2) * sigma_hat))
-            mu_hat = mu_hat_new
-            n += 1
-            self.sigma_Z.append(sigma_hat * np.sqrt((self.r / (2 - self.r)) * (1 - (1 - self.r) ** (2 * j))))
-            self.mu.append(mu_hat)
-            if self.Z[j] > mu_hat + self.sigma_Z[j] * self.L:
-                if j - last_cp > self.timeout:
-                    self.changepoints.append(j)
-                    last_cp = j
-                n = 2
+        self.Z, var_Z, self.mu, changepoints = _detect_core(
+            self.dissimilarity.astype(np.float64), self.r, self.L, self.burnin, self.timeout, False)
+        self.sigma_Z = np.sqrt(var_Z)
+        self.changepoints = changepoints.tolist()
     
     def detect_bump(self):
         """Detect sequential increase and decrease in the dissimilarity.
         """
-        n = 2
-        mu_hat = 0.
-        sigma_hat = 1.
-        last = None
-        last_det = None
-        for j in range(1, self.burnin):
-            self.Z.append((1 - self.r) * self.Z[j-1] + self.r * self.dissimilarity[j])
-            mu_hat_new = 1/n * ((n-1) * mu_hat + self.dissimilarity[j])
-            sigma_hat = np.sqrt(1 / (n - 1) * ((self.dissimilarity[j] - mu_hat_new) * 
-                                             (self.dissimilarity[j] - mu_hat) + (n - 2) * sigma_hat))
-            mu_hat = mu_hat_new
-            n += 1
-            self.sigma_Z.append(sigma_hat * np.sqrt((self.r / (2 - self.r)) * (1 - (1 - self.r) ** (2 * j))))
-            self.mu.append(mu_hat)
-        for j in range(self.burnin, len(self.dissimilarity)):
-            self.Z.append((1 - self.r) * self.Z[j-1] + self.r * self.dissimilarity[j])
-            mu_hat_new = 1/n * ((n-1) * mu_hat + self.dissimilarity[j])
-            sigma_hat = np.sqrt(1 / (n - 1) * ((self.dissimilarity[j] - mu_hat_new) * 
-                                             (self.dissimilarity[j] - mu_hat) + (n - 2) * sigma_hat))
-            mu_hat = mu_hat_new
-            n += 1
-            self.sigma_Z.append(sigma_hat * np.sqrt((self.r / (2 - self.r)) * (1 - (1 - self.r) ** (2 * j))))
-            self.mu.append(mu_hat)
-            if self.Z[j] > mu_hat + self.sigma_Z[j] * self.L and last_det is None:
-                last = "+"
-                last_det = j
-                n = 2
-            if self.Z[j] < mu_hat - self.sigma_Z[j] * self.L and last == "+":
-                last = "-"
-                n = 2
-                self.changepoints.append(last_det)
-                last_det = None
+        self.Z, var_Z, self.mu, changepoints = _detect_core(
+            self.dissimilarity.astype(np.float64), self.r, self.L, self.burnin, self.timeout, True)
+        self.sigma_Z = np.sqrt(var_Z)
+        self.changepoints = changepoints.tolist()
         
     def process(self, 
                 data: list):
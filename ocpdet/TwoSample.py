@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.stats import ranksums, mood, mannwhitneyu, ks_2samp, cramervonmises_2samp
+from scipy.stats import ranksums, mood, mannwhitneyu, ks_2samp, cramervonmises_2samp, rankdata
 
 class TwoSample():
     """Two sample test for changepoint detection.
@@ -48,6 +48,37 @@ class TwoSample():
             "Cramer-von-Mises": cramervonmises_2samp
         }
         self.statistic = db[self.statistic]
+        # Different syntax for each Scipy test, resolved once on a small sample
+        if isinstance(self.statistic([0., 2., 4., 6.], [1., 3., 5., 7.]), tuple):
+            self.extract = lambda result: abs(result[0])
+        else:
+            self.extract = lambda result: abs(result.statistic)
+    
+    def rank_statistics(self, 
+                        X: list):
+        """Compute a rank statistic for every split of a sample at once.
+
+        Parameters
+        ----------
+            
+        X : list
+            Univariate array to be split into X[:k] and X[k:] for k = 1, ..., len(X) - 1.
+
+        Returns
+        -------
+        
+        Dkn : ndarray of shape (len(X) - 1,)
+            Absolute value of the statistic for each split. The sample is ranked once, 
+            the rank sum of each first sample is then a cumulative sum of the ranks.
+        """
+        n1 = np.arange(1, len(X))
+        n2 = len(X) - n1
+        R = np.cumsum(rankdata(X))[:-1]
+        if self.statistic is ranksums:
+            # Wilcoxon rank-sum statistic of the first sample, normal approximation
+            return np.abs((R - n1 * (n1 + n2 + 1) / 2) / np.sqrt(n1 * n2 * (n1 + n2 + 1) / 12))
+        # Mann-Whitney U statistic of the first sample
+        return np.abs(R - n1 * (n1 + 1) / 2)
     
     def process_batch(self, 
                       X: list):
@@ -66,24 +97,31 @@ class TwoSample():
             First detected changepoint in X. If no change is detected, the method
             returns None.
         """
+        # Slices of an array are views, no split copies the data
+        X = np.asarray(X, dtype=np.float64)
         Dn = []
         tau = 0
         self.t = 2
         while self.t < len(X):
-            Dkn = []
-            for k in range(1, self.t):
-                x, y = X[tau:k], X[k:self.t]
-                # Different syntax for each Scipy test
-                try:
-                    Dkn.append(abs(self.statistic(x, y)[0]))
-                except:
+            # Every split is scanned again at each time step: a new observation changes the
+            # ranks, hence the statistic, of all splits, so candidates can not be pruned by 
+            # dominance as in FOCuS-type recursions for parametric costs
+            if self.statistic in (mannwhitneyu, ranksums):
+                Dkn = self.rank_statistics(X[tau:self.t])
+            else:
+                Dkn = np.empty(self.t - 1)
+                for k in range(1, self.t):
+                    x, y = X[tau:k], X[k:self.t]
                     try:
-                        Dkn.append(abs(self.statistic(x, y).statistic))
-                    except: # Edge cases with sample sizes 
-                        Dkn.append(0)
-            self.D.append(max(Dkn))
-            if max(Dkn) < self.threshold:
-                Dn.append(max(Dkn))
+                        Dkn[k-1] = self.extract(self.statistic(x, y))
+                    except ValueError: # Edge cases with sample sizes 
+                        Dkn[k-1] = 0
+                # Recent Scipy versions return NaN instead of raising on small samples
+                Dkn = np.nan_to_num(Dkn)
+            D = Dkn.max()
+            self.D.append(D)
+            if D < self.threshold:
+                Dn.append(D)
                 self.t += 1
             else:
                 tau = self.t
@@ -104,8 +142,11 @@ class TwoSample():
             and the whole sequence has been processed, the method stops.
         """
         self.fetch_statistic()
+        data = np.asarray(data, dtype=np.float64)
         cp = []
         tau = 0
+        # Batches are processed sequentially: each one starts at the detection time of the
+        # previous one, so segments are only known once the previous batch is processed
         while tau is not None:
             data = data[tau:]
             tau = self.process_batch(data)
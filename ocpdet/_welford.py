@@ -0,0 +1,24 @@
+import math
+import numpy as np
+from numba import njit
+
+@njit(inline="always", cache=True)
+def welford_step(mean, M2, x, n):
+    # Welford update of the mean and of the sum of squared deviations M2 with the n-th
+    # observation x, inlined into the compiled loops and called through py_func by the
+    # sequential update methods
+    delta = x - mean
+    mean += delta / n
+    M2 += delta * (x - mean)
+    return mean, M2
+
+@njit(cache=True)
+def sigma_Z_cutoff(r):
+    # First time index from which (1 - r) ** (2 * i) vanishes against 1 in double 
+    # precision, so that sigma_Z = sigma * sqrt(r / (2 - r)) exactly. Kept next to 
+    # welford_step as the other helper shared by the EWMA and NN compiled loops
+    if r == 1:
+        return 1
+    if abs(1 - r) >= 1:
+        return np.iinfo(np.int64).max
+    return math.ceil(math.log(np.finfo(np.float64).eps / 4) / (2 * math.log(abs(1 - r))))